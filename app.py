@@ -1,18 +1,27 @@
 import streamlit as st
 import os
+import sys
 import tempfile
+import time
 import uuid
-from processing import create_canopy_height_model, create_canopy_cover, classify_ground
-import tkinter as tk
-from tkinter import filedialog
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from processing import create_canopy_height_model, create_canopy_cover, classify_ground, classification_cache_path, load_points
 from PIL import Image #
 
+# A native file dialog needs a desktop session. On headless servers the Browse button is hidden.
+HAS_DISPLAY = os.name == 'nt' or sys.platform == 'darwin' or bool(os.environ.get('DISPLAY'))
+
 # --- Helper Function to open the file dialog ---
 def open_file_dialog():
     """
     Opens a file dialog and returns the selected path.
     This function is designed to be more robust when used with Streamlit.
     """
+    # Imported on first use only (later calls hit sys.modules), so app reruns never load tkinter.
+    import tkinter as tk
+    from tkinter import filedialog
+
     root = tk.Tk()
     root.withdraw()  # Hide the main tkinter window
     # Make the dialog appear on top of all other windows
@@ -31,31 +40,75 @@ def update_path_from_dialog():
     if selected_path:
         st.session_state.las_file_path = selected_path
 
-try:
-    # Open the original image
-    original_icon = Image.open("icon.webp")
-    
+# --- Cached point cloud loader ---
+# cache_resource rather than cache_data: the decoded arrays are large and read-only, so every
+# rerun can share the same objects instead of unpickling a fresh copy.
+@st.cache_resource(max_entries=3, show_spinner="Reading LAS file...")
+def load_cached_points(path, mtime):
+    """
+    Decodes a LAS/LAZ file once per (path, mtime), so tweaking parameters and re-running
+    on the same file skips decoding it again. mtime is only part of the cache key.
+    """
+    return load_points(path)
+
+# --- Background ground classification ---
+# Cached so every rerun and session shares one worker process; a plain module-level executor
+# would be recreated on each rerun. Spawned rather than forked, as the server is multithreaded.
+@st.cache_resource
+def get_classification_executor():
+    """
+    Returns the single-worker pool that runs classify_ground off the Streamlit script thread.
+    """
+    return ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+
+# --- Page icon ---
+@st.cache_resource
+def load_icon():
+    """
+    Returns the app icon padded to a square, built once per process. The padded copy is saved
+    as icon_square.png next to icon.webp and loaded directly while it is newer than icon.webp.
+    """
+    # Reuse the padded copy while it is newer than icon.webp; rebuild it if it is missing, stale
+    # or unreadable.
+    try:
+        if os.path.getmtime("icon_square.png") >= os.path.getmtime("icon.webp"):
+            square_icon = Image.open("icon_square.png")
+            square_icon.load()
+            return square_icon
+    except OSError:
+        pass
+    try:
+        # Open the original image
+        original_icon = Image.open("icon.webp")
+    except FileNotFoundError:
+        return "🌳"
+
     # Get original dimensions
     width, height = original_icon.size
-    
+
     # Determine the size for the new square background (the larger dimension)
     max_dim = max(width, height)
-    
+
     # Create a new square image with a transparent background (RGBA)
     square_icon = Image.new("RGBA", (max_dim, max_dim), (0, 0, 0, 0))
-    
+
     # Calculate the position to paste the original icon in the center
     paste_x = (max_dim - width) // 2
     paste_y = (max_dim - height) // 2
-    
+
     # Paste the original icon onto the new square background
     square_icon.paste(original_icon, (paste_x, paste_y))
-    
-    # Use the newly created square icon
-    icon = square_icon
 
-except FileNotFoundError:
-    icon = "🌳"
+    # Saved under a temporary name first, so another process never opens a half-written PNG.
+    partial_path = f"icon_square.{os.getpid()}.part.png"
+    try:
+        square_icon.save(partial_path)
+        os.replace(partial_path, "icon_square.png")
+    except OSError:
+        pass  # A read-only install just pads the icon again in the next process.
+    return square_icon
+
+icon = load_icon()
 
 # --- Page Configuration ---
 st.set_page_config(
@@ -66,11 +119,18 @@ st.set_page_config(
 
 # --- Main UI ---
 st.title("Point Cloud Processor")
-st.write("Provide the full path to your `.las` or `.laz` file, or use the browse button.")
+if HAS_DISPLAY:
+    st.write("Provide the full path to your `.las` or `.laz` file, or use the browse button.")
+else:
+    st.write("Provide the full path to your `.las` or `.laz` file.")
 
 # Initialize session state to hold the file path
 if 'las_file_path' not in st.session_state:
     st.session_state['las_file_path'] = ""
+# A running ground classification: its future, input file, mode, the analysis to run on its
+# result, and its start time.
+if 'classify_job' not in st.session_state:
+    st.session_state['classify_job'] = None
 
 # --- File Selection UI ---
 col1, col2 = st.columns([4, 1])
@@ -84,21 +144,22 @@ with col1:
         key="las_file_path"
     )
 
-with col2:
-    # This CSS pushes the button down to vertically align with the text input box
-    st.markdown(
-        """
-        <style>
-        div[data-testid="stVerticalBlock"] div[data-testid="stButton"] > button {
-            margin-top: 12px;
-        }
-        </style>
-        """,
-        unsafe_allow_html=True
-    )
-    # The button now uses an on_click callback. This function runs BEFORE the
-    # rest of the page is rerendered, safely updating the session state.
-    st.button("Browse...", on_click=update_path_from_dialog)
+if HAS_DISPLAY:
+    with col2:
+        # This CSS pushes the button down to vertically align with the text input box
+        st.markdown(
+            """
+            <style>
+            div[data-testid="stVerticalBlock"] div[data-testid="stButton"] > button {
+                margin-top: 12px;
+            }
+            </style>
+            """,
+            unsafe_allow_html=True
+        )
+        # The button now uses an on_click callback. This function runs BEFORE the
+        # rest of the page is rerendered, safely updating the session state.
+        st.button("Browse...", on_click=update_path_from_dialog)
 
 
 # Use the path from our single source of truth for the rest of the app
@@ -118,11 +179,19 @@ if las_file_path and os.path.exists(las_file_path):
 
     # --- Analysis Options ---
     st.header("Analysis Options")
-    # is_classified = st.checkbox(
-    #     "My data is already classified (contains ground points)",
-    #     value=False,
-    #     help="Check this box if your file already has points classified as ground (Code 2). Otherwise, the app will classify it for you."
-    # )
+    is_classified = st.checkbox(
+        "My data is already classified (contains ground points)",
+        value=False,
+        help="Check this box if your file already has points classified as ground (Code 2). Otherwise, the app will classify it for you."
+    )
+    fast_classification = False
+    if not is_classified:
+        fast_classification = st.checkbox(
+            "Fast ground classification",
+            value=False,
+            help="Uses a quicker progressive morphological filter (PMF) instead of SMRF. Much faster on large files, but can be less accurate on steep or complex terrain."
+        )
+    classification_mode = "fast" if fast_classification else "smrf"
 
     analysis_type = st.selectbox(
         "Select Analysis Type",
@@ -144,43 +213,92 @@ if las_file_path and os.path.exists(las_file_path):
         )
 
     # --- Run Button ---
-    if st.button(f"Run {analysis_type}", type="primary"):
+    classify_job = st.session_state['classify_job']
+    path_to_process = None
+    source_path = las_file_path
+    analysis = None
+    if st.button(f"Run {analysis_type}", type="primary", disabled=classify_job is not None):
+        # The settings are captured now, as the widgets stay editable while classification runs.
+        if analysis_type == "Canopy Height Model":
+            analysis = {"type": analysis_type, "resolution": resolution_chm}
+        else:
+            analysis = {"type": analysis_type, "resolution": resolution_cc, "height_threshold": height_threshold}
+        cache_path = classification_cache_path(las_file_path, classification_mode)
+        if is_classified:
+            path_to_process = las_file_path
+        elif os.path.exists(cache_path):
+            st.success("Loaded cached ground classification.")
+            path_to_process = cache_path
+        else:
+            # Classification can take minutes, so it runs in the background while the page
+            # keeps polling it below; the analysis starts on the rerun that finds it done.
+            # Only the cache entry is written, and its path is the job's result.
+            st.session_state['classify_job'] = {
+                "future": get_classification_executor().submit(
+                    classify_ground, las_file_path, None, classification_mode
+                ),
+                "source_path": las_file_path,
+                "mode": classification_mode,
+                "analysis": analysis,
+                "started": time.time(),
+            }
+    elif classify_job is not None and classify_job["future"].done():
+        st.session_state['classify_job'] = None
+        source_path = classify_job["source_path"]
+        analysis = classify_job["analysis"]
+        try:
+            path_to_process = classify_job["future"].result()
+        except Exception as e:
+            st.error(f"An error occurred during ground classification: {e}")
+            st.exception(e)
+        else:
+            st.success("Ground classification complete.")
+
+    if path_to_process is not None:
         try:
             with tempfile.TemporaryDirectory() as temp_dir:
-                path_to_process = las_file_path
-                
-                if not is_classified:
-                    with st.spinner("Classifying ground points... (This can be slow for large files)"):
-                        classified_temp_path = os.path.join(temp_dir, "classified_temp.laz")
-                        classify_ground(las_file_path, classified_temp_path)
-                        path_to_process = classified_temp_path
-                        st.success("Ground classification complete.")
-
-                output_filename = f"{os.path.splitext(os.path.basename(las_file_path))[0]}_{analysis_type.replace(' ', '_').lower()}.tif"
+                output_filename = f"{os.path.splitext(os.path.basename(source_path))[0]}_{analysis['type'].replace(' ', '_').lower()}.tif"
                 output_path = os.path.join(temp_dir, output_filename)
 
-                with st.spinner(f"Generating {analysis_type}..."):
-                    if analysis_type == "Canopy Height Model":
-                        create_canopy_height_model(path_to_process, output_path, resolution=resolution_chm)
-                    elif analysis_type == "Canopy Cover":
-                        create_canopy_cover(path_to_process, output_path, resolution=resolution_cc, height_threshold=height_threshold)
+                points = load_cached_points(path_to_process, os.path.getmtime(path_to_process))
+
+                with st.spinner(f"Generating {analysis['type']}..."):
+                    if analysis["type"] == "Canopy Height Model":
+                        create_canopy_height_model(path_to_process, output_path, resolution=analysis["resolution"], points=points)
+                    elif analysis["type"] == "Canopy Cover":
+                        create_canopy_cover(path_to_process, output_path, resolution=analysis["resolution"], height_threshold=analysis["height_threshold"], points=points)
 
                 st.success(f"✅ Analysis Complete!")
-                
-                with open(output_path, "rb") as f:
-                    file_bytes = f.read()
 
-                st.download_button(
-                    label="⬇️ Download Raster (.tif)",
-                    data=file_bytes,
-                    file_name=output_filename,
-                    mime="image/tiff"
-                )
+                # Rendered only on the run that produced the raster, so it is read from disk once.
+                with open(output_path, "rb") as f:
+                    st.download_button(
+                        label="⬇️ Download Raster (.tif)",
+                        data=f,
+                        file_name=output_filename,
+                        mime="image/tiff"
+                    )
 
         except Exception as e:
             st.error(f"An error occurred during processing: {e}")
             st.exception(e)
 
+    classify_job = st.session_state['classify_job']
+    if classify_job is not None:
+        elapsed = time.time() - classify_job["started"]
+        st.info(
+            f"Classifying ground points for **{os.path.basename(classify_job['source_path'])}**... "
+            f"{elapsed:.0f} s elapsed. (This can be slow for large files)"
+        )
+        # PDAL cannot be interrupted mid-run, so cancelling only stops waiting for it. A job
+        # that still finishes lands in the classification cache for the next run.
+        if st.button("Cancel"):
+            classify_job["future"].cancel()
+            st.session_state['classify_job'] = None
+            st.rerun()
+        time.sleep(0.5)
+        st.rerun()
+
 elif las_file_path:
     st.error("❌ File not found. Please check the path is correct.")
 else:
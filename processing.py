@@ -2,27 +2,174 @@ import numpy as np
 import laspy
 import rasterio
 from rasterio.transform import from_origin
-from scipy.interpolate import griddata
+from scipy.interpolate import LinearNDInterpolator
+from scipy.spatial import Delaunay, cKDTree
 import pdal
 import json
+import os
+import multiprocessing
+import hashlib
+import shutil
+import tempfile
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 
-def classify_ground(unclassified_las_path, classified_las_path):
+# Numba is an optional dependency (`pip install numba`). When it is installed, chunks are binned by
+# the fused _bin_points kernel, which is the canonical path; without it they are binned with NumPy
+# by _partial_hist, spread across a process pool for large clouds.
+try:
+    from numba import njit, prange, get_num_threads
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+
+# Number of points decoded per chunk when streaming a LAS/LAZ file.
+CHUNK_SIZE = 1_000_000
+
+# The only point dimensions the rasters need. For LAS 1.4 LAZ files (point formats 6-10), whose
+# fields are compressed in separate layers, every other layer is skipped instead of decompressed.
+POINT_DIMENSIONS = (
+    laspy.DecompressionSelection.XY_RETURNS_CHANNEL
+    | laspy.DecompressionSelection.Z
+    | laspy.DecompressionSelection.CLASSIFICATION
+)
+
+# LAZ decoder: lazrs' multi-threaded backend when it is installed, otherwise laspy's default.
+LAZ_BACKEND = laspy.LazBackend.LazrsParallel if laspy.LazBackend.LazrsParallel.is_available() else None
+
+# Number of worker processes used to aggregate point chunks onto the raster grid.
+MAX_WORKERS = os.cpu_count() or 1
+
+# Below this many points, pickling chunks to worker processes costs more than it saves.
+POOL_MIN_POINTS = 4 * CHUNK_SIZE
+
+# Upper bound on the memory used by the per-thread partial grids of the Numba kernel.
+NUMBA_PARTIALS_BYTES = 1 << 30
+
+# GeoTIFF creation options for the output rasters: 512x512 tiles, ZSTD compression with the
+# floating-point predictor, and BigTIFF only when the file could outgrow 4 GB.
+GEOTIFF_OPTIONS = {
+    "tiled": True,
+    "blockxsize": 512,
+    "blockysize": 512,
+    "compress": "ZSTD",
+    "zstd_level": 3,
+    "predictor": 3,
+    "BIGTIFF": "IF_SAFER",
+}
+
+def _geotiff_options(dtype):
+    """
+    Returns GEOTIFF_OPTIONS for a raster of dtype; integer rasters use the horizontal
+    differencing predictor, as the floating-point one only applies to float data.
+    """
+    if np.issubdtype(np.dtype(dtype), np.integer):
+        return {**GEOTIFF_OPTIONS, "predictor": 2}
+    return GEOTIFF_OPTIONS
+
+# The CHM is stored as int16 centimetres (up to 327 m), with a 0.01 band scale so GIS tools
+# read it back in metres.
+CHM_SCALE = 0.01
+CHM_NODATA = -32768
+
+# Ground filter stages for each classify_ground mode. "fast" trades some accuracy on steep or
+# complex terrain for a much quicker progressive morphological filter.
+GROUND_FILTERS = {
+    "smrf": [
+        {
+            "type": "filters.smrf"
+        }
+    ],
+    "fast": [
+        {
+            "type": "filters.assign",
+            "value": "Classification = 1"
+        },
+        {
+            "type": "filters.pmf",
+            "max_window_size": 33,
+            "slope": 1.0,
+            "initial_distance": 0.5,
+            "cell_size": 1.0
+        }
+    ],
+}
+
+def classification_cache_path(unclassified_las_path, mode="smrf"):
+    """
+    Returns where the classified copy of a LAS file is cached. The key covers the file's
+    path, size and modification time, so an edited or replaced file is classified again,
+    and the pipeline variant, so entries from a different pipeline are not reused.
+    """
+    path = os.path.abspath(unclassified_las_path)
+    variant = f"{mode}-last-returns"
+    key = hashlib.sha1(f"{variant}|{path}|{os.path.getsize(path)}|{os.path.getmtime(path)}".encode()).hexdigest()
+    return os.path.join(tempfile.gettempdir(), f"firemap_{key}.laz")
+
+def classify_ground(unclassified_las_path, classified_las_path=None, mode="smrf"):
     """
     Reads an unclassified LAS file, classifies ground points using a PDAL
-    SMRF pipeline, and saves a new classified LAS file.
+    pipeline over its last returns, and saves a new classified LAS file.
+    mode is "smrf" (default) or "fast", which uses PMF instead. Results are
+    cached on disk, so classifying the same file again skips PDAL entirely.
+    With classified_las_path=None only the cache entry is written. Returns the
+    path of the classified file.
     """
+    if mode not in GROUND_FILTERS:
+        raise ValueError(f"Unknown ground classification mode '{mode}'. Expected one of: {', '.join(GROUND_FILTERS)}.")
+
+    cache_path = classification_cache_path(unclassified_las_path, mode)
+    if os.path.exists(cache_path):
+        print(f"Using cached ground classification: {cache_path}")
+        if classified_las_path is None:
+            return cache_path
+        shutil.copy(cache_path, classified_las_path)
+        return classified_las_path
+
+    # Written under a temporary name first so an interrupted run never looks like a valid cache entry.
+    partial_cache_path = f"{os.path.splitext(cache_path)[0]}.{os.getpid()}.part.laz"
+    output_path = classified_las_path or partial_cache_path
+
     print("Building simplified PDAL pipeline for ground classification...")
 
-    # --- CORRECTED PIPELINE (This part is the same) ---
+    # Chain the mode's ground filter stages onto the last-returns branch.
+    ground_stages = [dict(stage) for stage in GROUND_FILTERS[mode]]
+    ground_stages[0]["inputs"] = ["last_returns"]
+    ground_stages[-1]["tag"] = "classified"
+
+    # Only last (or single) returns can hit the ground, so the ground filter only sees those.
+    # The remaining returns bypass it and are merged back in, so the output still holds every point.
+    # ">=" also keeps points whose NumberOfReturns was never populated (0).
     pipeline_json = {
         "pipeline": [
-            unclassified_las_path,
             {
-                "type": "filters.smrf"
+                "type": "readers.las",
+                "filename": unclassified_las_path,
+                "tag": "points"
+            },
+            {
+                "type": "filters.expression",
+                "inputs": ["points"],
+                "expression": "ReturnNumber >= NumberOfReturns",
+                "tag": "last_returns"
+            },
+            *ground_stages,
+            {
+                "type": "filters.expression",
+                "inputs": ["points"],
+                "expression": "ReturnNumber < NumberOfReturns",
+                "tag": "other_returns"
+            },
+            {
+                "type": "filters.merge",
+                "inputs": ["classified", "other_returns"],
+                "tag": "merged"
             },
             {
                 "type":"writers.las",
-                "filename": classified_las_path
+                "inputs": ["merged"],
+                "filename": output_path,
+                "extra_dims": "all"
             }
         ]
     }
@@ -36,111 +183,548 @@ def classify_ground(unclassified_las_path, classified_las_path):
     count = pipeline.execute()
     
     if count > 0:
+        if classified_las_path is None:
+            os.replace(partial_cache_path, cache_path)
+            print(f"PDAL classification complete. Processed {count} points. Classified file saved to: {cache_path}")
+            return cache_path
         print(f"PDAL classification complete. Processed {count} points. Classified file saved to: {classified_las_path}")
+        shutil.copy(classified_las_path, partial_cache_path)
+        os.replace(partial_cache_path, cache_path)
+        return classified_las_path
     else:
         raise RuntimeError("PDAL pipeline executed but produced no points. Check the input file and pipeline.")
 
 
-def create_canopy_height_model(las_path, output_raster_path, resolution=1.0):
+def _grid_from_bounds(min_x, min_y, max_x, max_y, resolution):
     """
-    Creates a Canopy Height Model (CHM) from a (now classified) LAS/LAZ file.
+    Snaps the lower-left corner to the resolution and returns the grid origin and cell coordinates.
     """
-    print("Reading LAS file for CHM...")
-    with laspy.open(las_path) as f:
-        las = f.read()
-
-    ground_points = las.points[las.classification == 2]
-    non_ground_points = las.points[las.classification != 2]
-
-    if len(ground_points) == 0:
-        raise ValueError("No ground points found in the file. Cannot create DTM.")
-    
-    print(f"Found {len(ground_points)} ground points and {len(non_ground_points)} non-ground points.")
-
-    min_x, min_y = np.min(las.x), np.min(las.y)
-    max_x, max_y = np.max(las.x), np.max(las.y)
     grid_x_min = np.floor(min_x / resolution) * resolution
     grid_y_min = np.floor(min_y / resolution) * resolution
     x_coords = np.arange(grid_x_min, max_x, resolution)
     y_coords = np.arange(grid_y_min, max_y, resolution)
+    return grid_x_min, grid_y_min, x_coords, y_coords
+
+def _grid_from_header(header, resolution):
+    """
+    Derives the raster grid from the LAS header bounds so it is fixed before any points are read.
+    The header can be stale, so callers should check it against _extend_bounds once the points are read.
+    """
+    return _grid_from_bounds(header.mins[0], header.mins[1], header.maxs[0], header.maxs[1], resolution)
+
+def _extend_bounds(bounds, x, y):
+    """
+    Grows the observed [min_x, min_y, max_x, max_y] bounds in place to include a chunk of points.
+    """
+    if x.size > 0:
+        bounds[0] = min(bounds[0], x.min())
+        bounds[1] = min(bounds[1], y.min())
+        bounds[2] = max(bounds[2], x.max())
+        bounds[3] = max(bounds[3], y.max())
+
+def _same_grid(grid_a, grid_b):
+    """
+    Returns True if two (grid_x_min, grid_y_min, x_coords, y_coords) grids share origin and shape.
+    """
+    return (
+        grid_a[0] == grid_b[0] and grid_a[1] == grid_b[1]
+        and len(grid_a[2]) == len(grid_b[2]) and len(grid_a[3]) == len(grid_b[3])
+    )
+
+def _raw_grid(header, grid_x_min, grid_y_min, resolution):
+    """
+    Expresses the grid origin and cell size in the file's raw integer coordinate units, as
+    (x0, step_x, y0, step_y). Values that are whole numbers are returned as ints, so binning
+    stays in exact integer arithmetic for the usual case of a resolution that is a multiple of
+    the scale.
+    """
+    raw = (
+        (grid_x_min - header.offsets[0]) / header.scales[0], resolution / header.scales[0],
+        (grid_y_min - header.offsets[1]) / header.scales[1], resolution / header.scales[1],
+    )
+    return tuple(int(round(v)) if abs(v - round(v)) < 1e-6 else v for v in raw)
+
+def _scaled_bounds(bounds, header):
+    """
+    Converts raw [min_X, min_Y, max_X, max_Y] bounds to scaled coordinates.
+    """
+    scale_x, scale_y = header.scales[0], header.scales[1]
+    offset_x, offset_y = header.offsets[0], header.offsets[1]
+    return (
+        bounds[0] * scale_x + offset_x, bounds[1] * scale_y + offset_y,
+        bounds[2] * scale_x + offset_x, bounds[3] * scale_y + offset_y,
+    )
+
+def _ground_points(ground_chunks, header):
+    """
+    Joins raw (X, Y, Z) ground chunks into contiguous arrays: one (N, 2) block of scaled x/y,
+    shared by the triangulation and the nearest-neighbour trees, and the raw Z on its own.
+    """
+    if not ground_chunks:
+        return np.empty((0, 2)), np.empty(0, dtype=np.int32)
+    raw_x = np.concatenate([chunk[0] for chunk in ground_chunks])
+    raw_y = np.concatenate([chunk[1] for chunk in ground_chunks])
+    raw_z = np.concatenate([chunk[2] for chunk in ground_chunks])
+    ground_xy = np.empty((len(raw_x), 2))
+    ground_xy[:, 0] = raw_x * header.scales[0] + header.offsets[0]
+    ground_xy[:, 1] = raw_y * header.scales[1] + header.offsets[1]
+    return ground_xy, raw_z
+
+def _voxel_min_z(ground_xy, ground_z, voxel_size):
+    """
+    Thins ground points to the lowest one in each voxel_size x voxel_size cell.
+    Returns the kept x/y block and z values.
+    """
+    ix = np.floor(ground_xy[:, 0] / voxel_size).astype(np.int64)
+    iy = np.floor(ground_xy[:, 1] / voxel_size).astype(np.int64)
+    ix -= ix.min()
+    iy -= iy.min()
+    flat = ix * (iy.max() + 1) + iy
+    # Sort by cell, then by height, so the first point of each cell run is its lowest.
+    order = np.lexsort((ground_z, flat))
+    flat_sorted = flat[order]
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(flat_sorted)) + 1))
+    pick = order[starts]
+    return ground_xy[pick], ground_z[pick]
+
+def _flat_cell_indices(X, Y, raw_grid, rows, cols):
+    """
+    Returns the flat (row * cols + col) cell id of each in-bounds point and the in-bounds mask.
+    X and Y are the raw integer coordinates and raw_grid comes from _raw_grid.
+    """
+    x0, step_x, y0, step_y = raw_grid
+    col_indices = (X.astype(np.int64) - x0) // step_x
+    row_indices = (Y.astype(np.int64) - y0) // step_y
+    row_indices = (rows - 1) - row_indices
+    valid_indices = (row_indices >= 0) & (row_indices < rows) & (col_indices >= 0) & (col_indices < cols)
+    flat = row_indices[valid_indices].astype(np.int64) * cols + col_indices[valid_indices].astype(np.int64)
+    return flat, valid_indices
+
+def _read_xyz_class(las_path):
+    """
+    Yields the raw integer X, Y, Z and classification arrays of the file in CHUNK_SIZE chunks.
+    A single stream is enough: LAZ_BACKEND already decodes the 50,000-point LAZ chunks of each
+    read across all cores. Scaling to real-world units is left to the callers that need it.
+    """
+    with laspy.open(las_path, laz_backend=LAZ_BACKEND, decompression_selection=POINT_DIMENSIONS) as reader:
+        for points in reader.chunk_iterator(CHUNK_SIZE):
+            yield np.asarray(points.X), np.asarray(points.Y), np.asarray(points.Z), np.asarray(points.classification)
+
+# A fully decoded point cloud: the LAS header plus its raw integer X, Y, Z and classification.
+PointCloud = namedtuple("PointCloud", ["header", "X", "Y", "Z", "classification"])
+
+def load_points(las_path):
+    """
+    Decodes the dimensions the rasters need from a LAS/LAZ file into a read-only PointCloud.
+    Passing it to create_canopy_height_model or create_canopy_cover skips decoding the file
+    again, which lets callers such as the app reuse one decode across runs.
+    """
+    with laspy.open(las_path) as reader:
+        header = reader.header
+    arrays = [[], [], [], []]
+    for chunk in _read_xyz_class(las_path):
+        for values, array in zip(arrays, chunk):
+            values.append(array)
+    columns = []
+    for values, dtype in zip(arrays, (np.int32, np.int32, np.int32, np.uint8)):
+        column = np.concatenate(values) if values else np.empty(0, dtype=dtype)
+        column.flags.writeable = False
+        columns.append(column)
+    return PointCloud(header, *columns)
+
+def _point_chunks(las_path, points=None):
+    """
+    Yields raw (X, Y, Z, classification) chunks, either sliced from a pre-loaded PointCloud
+    or decoded from las_path.
+    """
+    if points is None:
+        yield from _read_xyz_class(las_path)
+        return
+    for start in range(0, len(points.X), CHUNK_SIZE):
+        end = start + CHUNK_SIZE
+        yield points.X[start:end], points.Y[start:end], points.Z[start:end], points.classification[start:end]
+
+# Raw max-Z value of a cell that no non-ground point has landed in yet.
+EMPTY_RAW_Z = np.iinfo(np.int32).min
+
+def _partial_hist(X, Y, Z, cls, raw_grid, rows, cols, raw_threshold):
+    """
+    Aggregates one chunk of points onto the grid. Only occupied cells are returned, as
+    (cells, total returns, returns above raw_threshold, max non-ground raw Z), to keep the
+    result small when it is sent back from a worker process.
+    """
+    flat, valid_indices = _flat_cell_indices(X, Y, raw_grid, rows, cols)
+    if flat.size == 0:
+        return flat, np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int32)
+    order = np.argsort(flat, kind='stable')
+    flat_sorted = flat[order]
+    z_sorted = Z[valid_indices][order]
+    non_ground_z = np.where(cls[valid_indices][order] != 2, z_sorted, EMPTY_RAW_Z).astype(np.int32)
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(flat_sorted)) + 1))
+    total = np.diff(np.append(starts, flat_sorted.size))
+    above = np.add.reduceat((z_sorted > raw_threshold).astype(np.int64), starts)
+    max_z = np.maximum.reduceat(non_ground_z, starts)
+    return flat_sorted[starts], total, above, max_z
+
+if HAS_NUMBA:
+    @njit(parallel=True, cache=True)
+    def _bin_points(X, Y, Z, cls, x0, step_x, y0, step_y, rows, cols, raw_threshold,
+                    total_returns, above_threshold_returns, max_z):
+        """
+        Bins one chunk in a single fused pass over the raw integer coordinates, without per-point
+        temporaries. Each block of points is scattered into its own row of the (blocks, rows * cols)
+        partial grids, so threads never write to the same cell; the caller reduces the rows once
+        all chunks are binned.
+        """
+        n_blocks = total_returns.shape[0]
+        block_size = (X.size + n_blocks - 1) // n_blocks
+        for block in prange(n_blocks):
+            for i in range(block * block_size, min(X.size, (block + 1) * block_size)):
+                col = int((np.int64(X[i]) - x0) // step_x)
+                row = rows - 1 - int((np.int64(Y[i]) - y0) // step_y)
+                if 0 <= row < rows and 0 <= col < cols:
+                    cell = row * cols + col
+                    total_returns[block, cell] += 1
+                    if Z[i] > raw_threshold:
+                        above_threshold_returns[block, cell] += 1
+                    if cls[i] != 2 and Z[i] > max_z[block, cell]:
+                        max_z[block, cell] = Z[i]
+
+def _aggregate_chunks(point_chunks, raw_grid, rows, cols, point_count, z_scale, z_offset, height_threshold=0.0):
+    """
+    Aggregates raw (X, Y, Z, classification) chunks into per-cell total returns, returns above
+    height_threshold and max non-ground z. Heights are compared and maxed as raw integers and
+    only scaled (Z * z_scale + z_offset) once per cell at the end. Uses the Numba kernel when
+    it is installed. Otherwise large clouds are spread across worker processes, and small
+    clouds, or single-core machines, are aggregated in this process.
+    """
+    raw_threshold = (height_threshold - z_offset) / z_scale
+
+    if HAS_NUMBA:
+        # One partial grid per thread, capped so the partials stay within NUMBA_PARTIALS_BYTES.
+        # An empty grid (rows * cols == 0) gets a single, empty partial.
+        n_blocks = max(1, min(get_num_threads(), NUMBA_PARTIALS_BYTES // max(1, rows * cols * 12)))
+        total_partials = np.zeros((n_blocks, rows * cols), dtype=np.int32)
+        above_partials = np.zeros((n_blocks, rows * cols), dtype=np.int32)
+        max_z_partials = np.full((n_blocks, rows * cols), EMPTY_RAW_Z, dtype=np.int32)
+        for X, Y, Z, cls in point_chunks:
+            _bin_points(X, Y, Z, cls, *raw_grid, rows, cols, raw_threshold, total_partials, above_partials, max_z_partials)
+        total_returns = total_partials.sum(axis=0, dtype=np.int64)
+        above_threshold_returns = above_partials.sum(axis=0, dtype=np.int64)
+        max_raw_z = max_z_partials.max(axis=0)
+    else:
+        total_returns = np.zeros(rows * cols, dtype=np.int64)
+        above_threshold_returns = np.zeros(rows * cols, dtype=np.int64)
+        max_raw_z = np.full(rows * cols, EMPTY_RAW_Z, dtype=np.int32)
+
+        def merge(partial):
+            cells, total, above, partial_max_z = partial
+            total_returns[cells] += total
+            above_threshold_returns[cells] += above
+            max_raw_z[cells] = np.maximum(max_raw_z[cells], partial_max_z)
+
+        if MAX_WORKERS == 1 or point_count < POOL_MIN_POINTS:
+            for X, Y, Z, cls in point_chunks:
+                merge(_partial_hist(X, Y, Z, cls, raw_grid, rows, cols, raw_threshold))
+        else:
+            # Spawn rather than fork: the LAZ decoder's threads may be mid-decode when workers start.
+            spawn = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=MAX_WORKERS, mp_context=spawn) as executor:
+                pending = set()
+                for X, Y, Z, cls in point_chunks:
+                    pending.add(executor.submit(_partial_hist, X, Y, Z, cls, raw_grid, rows, cols, raw_threshold))
+                    # Bound the number of chunks in flight so streaming still caps memory use.
+                    if len(pending) >= 2 * MAX_WORKERS:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            merge(future.result())
+                for future in pending:
+                    merge(future.result())
+
+    empty_cells = max_raw_z == EMPTY_RAW_Z
+    max_z = (max_raw_z * z_scale + z_offset).astype(np.float32)
+    max_z[empty_cells] = -9999.0
+    return (
+        total_returns.reshape(rows, cols),
+        above_threshold_returns.reshape(rows, cols),
+        max_z.reshape(rows, cols),
+    )
+
+def _gdal_writer(filename, las_path, resolution, output_type, inputs=None, data_type="float32", nodata=-9999):
+    """
+    Builds a writers.gdal stage that bins points into the grid laid out from the LAS header
+    bounds. binmode makes each point count only towards the cell it falls in, rather than every
+    cell within the default radius.
+    Unlike the NumPy engine, the PDAL engine trusts the header: finding the true extent would
+    mean decoding the file before PDAL reads it again, so points outside stale header bounds
+    are dropped. Each output raster is written by its own stage, and they only line up because
+    they all share this header grid.
+    """
+    with laspy.open(las_path) as reader:
+        grid_x_min, grid_y_min, x_coords, y_coords = _grid_from_header(reader.header, resolution)
+    stage = {
+        "type": "writers.gdal",
+        "filename": filename,
+        "resolution": resolution,
+        "binmode": True,
+        "output_type": output_type,
+        "origin_x": float(grid_x_min),
+        "origin_y": float(grid_y_min),
+        "width": len(x_coords),
+        "height": len(y_coords),
+        "nodata": nodata,
+        "data_type": data_type,
+        "gdaldriver": "GTiff",
+        "gdalopts": ",".join(
+            f"{key.upper()}={'YES' if value is True else value}" for key, value in _geotiff_options(data_type).items()
+        )
+    }
+    if inputs is not None:
+        stage["inputs"] = inputs
+    return stage
+
+def _create_canopy_height_model_pdal(las_path, output_raster_path, resolution):
+    """
+    Creates a CHM entirely inside PDAL: heights above a Delaunay ground surface, clamped
+    at zero, are rasterized to the per-cell max. Cells without points are left as nodata.
+    """
+    print("Building PDAL pipeline for CHM...")
+    pipeline_json = {
+        "pipeline": [
+            las_path,
+            {
+                "type": "filters.hag_delaunay"
+            },
+            {
+                "type": "filters.ferry",
+                "dimensions": "HeightAboveGround=>Z"
+            },
+            {
+                "type": "filters.assign",
+                "value": "Z = 0 WHERE Z < 0"
+            },
+            {
+                "type": "filters.assign",
+                "value": f"Z = Z / {CHM_SCALE}"
+            },
+            {
+                # Clamp like the NumPy engine, so heights over 327.67 m saturate instead of overflowing int16.
+                "type": "filters.assign",
+                "value": f"Z = {np.iinfo(np.int16).max} WHERE Z > {np.iinfo(np.int16).max}"
+            },
+            _gdal_writer(output_raster_path, las_path, resolution, "max", data_type="int16", nodata=CHM_NODATA)
+        ]
+    }
+    print(f"Saving CHM to {output_raster_path}")
+    pdal.Pipeline(json.dumps(pipeline_json)).execute()
+    with rasterio.open(output_raster_path, 'r+') as dst:
+        dst.scales = [CHM_SCALE]
+
+def _create_canopy_cover_pdal(las_path, output_raster_path, resolution, height_threshold):
+    """
+    Counts all returns and returns above height_threshold with PDAL, then divides the
+    two count rasters to get the cover percentage.
+    """
+    print("Building PDAL pipeline for canopy cover...")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        total_path = os.path.join(temp_dir, "total_returns.tif")
+        above_path = os.path.join(temp_dir, "above_threshold_returns.tif")
+        pipeline_json = {
+            "pipeline": [
+                {
+                    "type": "readers.las",
+                    "filename": las_path
+                },
+                {
+                    "type": "filters.hag_delaunay",
+                    "tag": "normalized"
+                },
+                _gdal_writer(total_path, las_path, resolution, "count", inputs=["normalized"]),
+                {
+                    "type": "filters.expression",
+                    "inputs": ["normalized"],
+                    "expression": f"HeightAboveGround > {height_threshold}",
+                    "tag": "above_threshold"
+                },
+                _gdal_writer(above_path, las_path, resolution, "count", inputs=["above_threshold"])
+            ]
+        }
+        print("Tallying points for canopy cover...")
+        pdal.Pipeline(json.dumps(pipeline_json)).execute()
+
+        with rasterio.open(total_path) as src:
+            profile = src.profile
+            total_returns = src.read(1, masked=True).filled(0)
+        with rasterio.open(above_path) as src:
+            above_threshold_returns = src.read(1, masked=True).filled(0)
+
+    print("Calculating cover percentage...")
+    canopy_cover = np.full(total_returns.shape, -9999.0, dtype=np.float32)
+    valid_cells = total_returns > 0
+    canopy_cover[valid_cells] = (above_threshold_returns[valid_cells] / total_returns[valid_cells]) * 100
+
+    print(f"Saving canopy cover to {output_raster_path}")
+    profile.update(driver='GTiff', count=1, dtype=rasterio.float32, nodata=-9999.0, **GEOTIFF_OPTIONS)
+    with rasterio.open(output_raster_path, 'w', **profile) as dst:
+        dst.write(canopy_cover, 1)
+
+def create_canopy_height_model(las_path, output_raster_path, resolution=1.0, engine="numpy", points=None):
+    """
+    Creates a Canopy Height Model (CHM) from a (now classified) LAS/LAZ file.
+    The CHM is written as int16 centimetres with a CHM_SCALE band scale.
+    points can be a PointCloud from load_points for las_path, to skip decoding it again.
+    engine="pdal" builds the raster natively in PDAL instead (see _create_canopy_height_model_pdal);
+    it lays the grid out from the header bounds without checking them against the points.
+    """
+    if engine == "pdal":
+        return _create_canopy_height_model_pdal(las_path, output_raster_path, resolution)
+    if engine != "numpy":
+        raise ValueError(f"Unknown engine '{engine}'. Expected 'numpy' or 'pdal'.")
+
+    print("Reading LAS file for CHM...")
+    if points is not None:
+        header = points.header
+    else:
+        with laspy.open(las_path) as reader:
+            header = reader.header
+    crs = header.parse_crs()
+    header_grid = _grid_from_header(header, resolution)
+    grid_x_min, grid_y_min, x_coords, y_coords = header_grid
     cols = len(x_coords)
     rows = len(y_coords)
-    
+    point_count = header.point_count
+    if point_count == 0:
+        raise ValueError("No ground points found in the file. Cannot create DTM.")
+
+    print("Creating DSM...")
+    ground_chunks = []
+    bounds = [np.inf, np.inf, -np.inf, -np.inf]
+
+    def collect_ground(point_chunks):
+        # Only ground points are kept in memory; they are needed together for the DTM.
+        for X, Y, Z, cls in point_chunks:
+            _extend_bounds(bounds, X, Y)
+            is_ground = cls == 2
+            ground_chunks.append((X[is_ground], Y[is_ground], Z[is_ground]))
+            yield X, Y, Z, cls
+
+    _, _, dsm = _aggregate_chunks(
+        collect_ground(_point_chunks(las_path, points)),
+        _raw_grid(header, grid_x_min, grid_y_min, resolution),
+        rows, cols, point_count, header.scales[2], header.offsets[2]
+    )
+
+    # The grid must span the points themselves. If the header bounds are stale, redo the DSM
+    # pass on the observed extent rather than silently dropping the points outside it.
+    observed_grid = _grid_from_bounds(*_scaled_bounds(bounds, header), resolution)
+    if not _same_grid(header_grid, observed_grid):
+        print("LAS header bounds do not match the points. Rebuilding DSM on the observed extent...")
+        grid_x_min, grid_y_min, x_coords, y_coords = observed_grid
+        cols = len(x_coords)
+        rows = len(y_coords)
+        _, _, dsm = _aggregate_chunks(
+            _point_chunks(las_path, points),
+            _raw_grid(header, grid_x_min, grid_y_min, resolution),
+            rows, cols, point_count, header.scales[2], header.offsets[2]
+        )
+
+    ground_xy, ground_z = _ground_points(ground_chunks, header)
+    if len(ground_xy) == 0:
+        raise ValueError("No ground points found in the file. Cannot create DTM.")
+    ground_z = ground_z * header.scales[2] + header.offsets[2]
+
+    print(f"Found {len(ground_xy)} ground points and {point_count - len(ground_xy)} non-ground points.")
+
     print("Creating DTM...")
-    ground_xyz = np.vstack((ground_points.x, ground_points.y, ground_points.z)).transpose()
+    # One ground point per half-cell is plenty for the DTM; keeping the lowest guards against
+    # misclassified low vegetation, and a smaller input makes the triangulation much cheaper.
+    ground_xy, ground_z = _voxel_min_z(ground_xy, ground_z, resolution / 2)
+    print(f"Thinned ground to {len(ground_xy)} points for interpolation.")
     grid_x, grid_y = np.meshgrid(x_coords, y_coords)
-    dtm = griddata(ground_xyz[:, :2], ground_xyz[:, 2], (grid_x, grid_y), method='linear')
-    dtm = griddata(ground_xyz[:, :2], ground_xyz[:, 2], (grid_x, grid_y), method='nearest', fill_value=np.nan)
+    # Triangulate the ground once, then fill cells outside the hull from the nearest ground point.
+    triangulation = Delaunay(ground_xy)
+    dtm = LinearNDInterpolator(triangulation, ground_z)(grid_x, grid_y)
+    nan_cells = np.isnan(dtm)
+    if nan_cells.any():
+        tree = cKDTree(ground_xy)
+        _, nearest = tree.query(np.column_stack([grid_x[nan_cells], grid_y[nan_cells]]))
+        dtm[nan_cells] = ground_z[nearest]
     dtm = np.flipud(dtm)
 
-    print("Creating DSM...")
-    dsm = np.full((rows, cols), -9999.0, dtype=np.float32)
-    col_indices = np.floor((non_ground_points.x - grid_x_min) / resolution).astype(int)
-    row_indices = np.floor((non_ground_points.y - grid_y_min) / resolution).astype(int)
-    row_indices = (rows - 1) - row_indices
-    unique_cells = np.unique(np.vstack([row_indices, col_indices]).T, axis=0)
-    for r, c in unique_cells:
-        if 0 <= r < rows and 0 <= c < cols:
-            mask = (row_indices == r) & (col_indices == c)
-            dsm[r, c] = np.max(non_ground_points.z[mask])
-    dsm[dsm == -9999.0] = dtm[dsm == -9999.0]
+    np.copyto(dsm, dtm, where=dsm == -9999.0)
 
     print("Calculating CHM...")
+    # Heights are clamped to [0, int16 max] in centimetres in place, then nodata is set in one pass.
     chm = dsm - dtm
-    chm[chm < 0] = 0
-    chm[np.isnan(dtm)] = -9999.0
+    chm /= CHM_SCALE
+    np.clip(chm, 0, np.iinfo(np.int16).max, out=chm)
+    np.round(chm, out=chm)
+    chm = np.where(np.isnan(dtm), CHM_NODATA, chm).astype(np.int16)
 
     print(f"Saving CHM to {output_raster_path}")
     transform = from_origin(grid_x_min, y_coords.max(), resolution, resolution)
     with rasterio.open(
         output_raster_path, 'w', driver='GTiff', height=rows, width=cols,
-        count=1, dtype=rasterio.float32, crs=las.header.parse_crs(),
-        transform=transform, nodata=-9999.0
+        count=1, dtype=rasterio.int16, crs=crs,
+        transform=transform, nodata=CHM_NODATA, **_geotiff_options(rasterio.int16)
     ) as dst:
-        dst.write(chm.astype(rasterio.float32), 1)
+        dst.scales = [CHM_SCALE]
+        dst.write(chm, 1)
 
-def create_canopy_cover(las_path, output_raster_path, resolution=10.0, height_threshold=2.0):
+def create_canopy_cover(las_path, output_raster_path, resolution=10.0, height_threshold=2.0, engine="numpy", points=None):
     """
     Calculates canopy cover. This function also expects a classified file.
+    points can be a PointCloud from load_points for las_path, to skip decoding it again.
+    engine="pdal" tallies the returns natively in PDAL instead (see _create_canopy_cover_pdal);
+    it lays the grid out from the header bounds without checking them against the points.
     """
+    if engine == "pdal":
+        return _create_canopy_cover_pdal(las_path, output_raster_path, resolution, height_threshold)
+    if engine != "numpy":
+        raise ValueError(f"Unknown engine '{engine}'. Expected 'numpy' or 'pdal'.")
+
     print("Reading LAS file for canopy cover...")
-    with laspy.open(las_path) as f:
-        las = f.read()
+    if points is not None:
+        header = points.header
+    else:
+        with laspy.open(las_path) as reader:
+            header = reader.header
+    crs = header.parse_crs()
 
-    ground_points = las.points[las.classification == 2]
-    if len(ground_points) == 0:
+    # First pass: only the ground points are kept, to build the height-normalization lookup.
+    # The grid is taken from the observed point bounds, so a stale header cannot clip it.
+    ground_chunks = []
+    bounds = [np.inf, np.inf, -np.inf, -np.inf]
+    for X, Y, Z, cls in _point_chunks(las_path, points):
+        _extend_bounds(bounds, X, Y)
+        is_ground = cls == 2
+        ground_chunks.append((X[is_ground], Y[is_ground], Z[is_ground]))
+    ground_xy, ground_raw_z = _ground_points(ground_chunks, header)
+    if len(ground_xy) == 0:
         raise ValueError("No ground points found. Cannot normalize heights for cover calculation.")
-        
-    print("Normalizing point heights...")
-    dtm_interpolator = griddata(
-        (ground_points.x, ground_points.y), 
-        ground_points.z, 
-        (las.x, las.y), 
-        method='nearest'
-    )
-    normalized_z = las.z - dtm_interpolator
-
-    min_x, min_y = np.min(las.x), np.min(las.y)
-    max_x, max_y = np.max(las.x), np.max(las.y)
-    grid_x_min = np.floor(min_x / resolution) * resolution
-    grid_y_min = np.floor(min_y / resolution) * resolution
-    x_coords = np.arange(grid_x_min, max_x, resolution)
-    y_coords = np.arange(grid_y_min, max_y, resolution)
+    ground_tree = cKDTree(ground_xy)
+    grid_x_min, grid_y_min, x_coords, y_coords = _grid_from_bounds(*_scaled_bounds(bounds, header), resolution)
     cols = len(x_coords)
     rows = len(y_coords)
 
+    def normalize_heights(point_chunks):
+        # Normalize each chunk against the nearest ground point before it is tallied. Both
+        # heights share the file's Z scale and offset, so the difference stays in raw units.
+        for X, Y, Z, cls in point_chunks:
+            query_xy = np.column_stack((
+                X * header.scales[0] + header.offsets[0], Y * header.scales[1] + header.offsets[1]
+            ))
+            _, nearest = ground_tree.query(query_xy)
+            yield X, Y, Z - ground_raw_z[nearest], cls
+
+    # Second pass: tally every return, and those above the height threshold, per cell.
     print("Tallying points for canopy cover...")
-    total_returns = np.zeros((rows, cols), dtype=np.int32)
-    above_threshold_returns = np.zeros((rows, cols), dtype=np.int32)
-    col_indices = np.floor((las.x - grid_x_min) / resolution).astype(int)
-    row_indices = np.floor((las.y - grid_y_min) / resolution).astype(int)
-    row_indices = (rows - 1) - row_indices
-    valid_indices = (row_indices >= 0) & (row_indices < rows) & (col_indices >= 0) & (col_indices < cols)
-    np.add.at(total_returns, (row_indices[valid_indices], col_indices[valid_indices]), 1)
-    above_mask = normalized_z > height_threshold
-    valid_above_indices = valid_indices & above_mask
-    np.add.at(above_threshold_returns, (row_indices[valid_above_indices], col_indices[valid_above_indices]), 1)
-    
+    total_returns, above_threshold_returns, _ = _aggregate_chunks(
+        normalize_heights(_point_chunks(las_path, points)),
+        _raw_grid(header, grid_x_min, grid_y_min, resolution),
+        rows, cols, header.point_count, header.scales[2], 0.0, height_threshold=height_threshold
+    )
+
     print("Calculating cover percentage...")
     canopy_cover = np.full((rows, cols), -9999.0, dtype=np.float32)
     valid_cells = total_returns > 0
@@ -150,8 +734,7 @@ def create_canopy_cover(las_path, output_raster_path, resolution=10.0, height_th
     transform = from_origin(grid_x_min, y_coords.max(), resolution, resolution)
     with rasterio.open(
         output_raster_path, 'w', driver='GTiff', height=rows, width=cols,
-        count=1, dtype=rasterio.float32, crs=las.header.parse_crs(),
-        transform=transform, nodata=-9999.0
+        count=1, dtype=rasterio.float32, crs=crs,
+        transform=transform, nodata=-9999.0, **GEOTIFF_OPTIONS
     ) as dst:
-        dst.write(canopy_cover.astype(rasterio.float32), 1)
-
+        dst.write(canopy_cover, 1)